@@ -1,9 +1,17 @@
 import os
-from flask_app import app
+import sys
+from flask_app import app, start_cache_warmup
 
 if __name__ == "__main__":
-    # Get port from environment variable (Hugging Face uses 7860)
-    port = int(os.environ.get("PORT", 7860))
-    
-    # Run the app
-    app.run(host="0.0.0.0", port=port, debug=False) 
\ No newline at end of file
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:
+        # gunicorn doesn't run on Windows, so fall back to Flask's threaded server
+        port = int(os.environ.get("PORT", 7860))
+        start_cache_warmup()
+        app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
+    else:
+        # Serve with gunicorn; worker and port settings live in gunicorn.conf.py
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        sys.argv = ["gunicorn", "--config", os.path.join(app_dir, "gunicorn.conf.py"), "--chdir", app_dir, "app:app"]
+        run()
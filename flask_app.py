@@ -1,20 +1,116 @@
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, Response, render_template, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-import io
+import hashlib
+import json
+import os
 import re
+import sys
+import threading
 import logging
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson, which is much faster on large version lists"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 
-# In-memory cache
-memory_cache = {}
+# In-memory LRU cache: year -> (cached_time, year_data, size in bytes), least recently used first
+memory_cache = OrderedDict()
+memory_cache_bytes = 0
+memory_cache_lock = threading.Lock()
 CACHE_DURATION = timedelta(minutes=30)  # Cache for 30 minutes
+MEMORY_CACHE_MAX_BYTES = int(os.environ.get('MEMORY_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# On-disk parquet cache, so fetched years survive process restarts (requires pyarrow)
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+
+# Only the columns used by the endpoints are tokenized
+NHTSA_COLUMNS = ['manufacturername', 'name', 'letterdate', 'url']
+
+# Cells read as missing by both CSV readers (pandas' default NA strings)
+CSV_NULL_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+# Years currently being loaded, so concurrent cache misses share one fetch
+inflight_fetches = {}
+inflight_lock = threading.Lock()
+INFLIGHT_WAIT_TIMEOUT = 120  # Seconds a request waits on another thread's fetch before giving up
+
+MAX_PAGES = 10  # Limit to prevent infinite loops
+PAGE_FETCH_WORKERS = 8  # Concurrent page requests per year
+
+# Shared HTTP session so NHTSA page and PDF requests reuse pooled keep-alive connections,
+# retrying transient failures with backoff; the final response is returned so status codes are still logged.
+# Retry-After is ignored because urllib3 would sleep for whatever the server asks, blocking a request thread
+http_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False, respect_retry_after_header=False
+    )
+)
+http_session = requests.Session()
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+
+# Browser caching: JSON lists live as long as the server-side cache, PDFs never change
+JSON_CACHE_CONTROL = 'public, max-age=1800'
+PDF_CACHE_CONTROL = 'public, max-age=86400, immutable'
+
+PDF_CHUNK_SIZE = 64 * 1024  # Bytes relayed per chunk when proxying PDFs
+
+# In-memory LRU cache of proxied PDFs: url -> content, least recently used first
+pdf_cache = OrderedDict()
+pdf_cache_bytes = 0
+pdf_cache_lock = threading.Lock()
+PDF_CACHE_MAX_ENTRIES = 64
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+PDF_CACHE_MAX_ENTRY_BYTES = 10 * 1024 * 1024  # Larger PDFs are relayed but not cached
+
+# Characters stripped from generated PDF filenames
+FILENAME_DISALLOWED_CHARS = re.compile(r'[^a-zA-Z0-9\s-]')
+FILENAME_WHITESPACE = re.compile(r'\s')  # Any Unicode whitespace, so the filename stays ASCII-safe in headers
 
 def get_year_range():
     """Get year range from current year to 1980"""
@@ -23,70 +119,462 @@ def get_year_range():
 
 def clean_filename(text):
     """Clean string for filename"""
-    cleaned = re.sub(r'[^a-zA-Z0-9\s-]', '', text)
-    cleaned = cleaned.replace(' ', '_')
+    cleaned = FILENAME_DISALLOWED_CHARS.sub('', text)
+    cleaned = FILENAME_WHITESPACE.sub('_', cleaned)
     return cleaned
 
+def read_nhtsa_csv(source):
+    """Parse an NHTSA CSV response as text, using the pyarrow reader when available"""
+    if HAS_PYARROW:
+        # Declaring every column as a string stops pyarrow inferring numbers, booleans and timestamps
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=NHTSA_COLUMNS,
+            column_types={column: pa.string() for column in NHTSA_COLUMNS},
+            null_values=CSV_NULL_VALUES,
+            strings_can_be_null=True
+        )
+        df = pa_csv.read_csv(source, convert_options=convert_options).to_pandas()
+        # Missing cells arrive as None; use NaN like the C engine
+        return df.fillna(np.nan)
+    
+    return pd.read_csv(
+        source, usecols=NHTSA_COLUMNS, dtype=str, keep_default_na=False, na_values=CSV_NULL_VALUES,
+        engine='c', low_memory=False
+    )[NHTSA_COLUMNS]
+
+@dataclass
+class YearData:
+    """Lookups precomputed from one year of NHTSA data so endpoints skip pandas work"""
+    data: pd.DataFrame
+    manufacturers_by_name: list = field(default_factory=list)
+    manufacturers_by_date: list = field(default_factory=list)
+    versions: list = field(default_factory=list)
+    versions_by_mfr: dict = field(default_factory=dict)
+    pdf_index: dict = field(default_factory=dict)
+    etag: str = ''
+    nbytes: int = 0  # Approximate memory held by the data and its lookups
+
+    @property
+    def empty(self):
+        return self.data.empty
+
+@dataclass
+class InflightFetch:
+    """A year being loaded by one thread, whose result is handed to the threads waiting on it"""
+    done: threading.Event = field(default_factory=threading.Event)
+    year_data: YearData = None
+
+def build_year_data(data):
+    """Build the endpoint lookups for a year of NHTSA data"""
+    year_data = YearData(data)
+    if data.empty:
+        return year_data
+    
+    # Repetitive text columns become categories: each distinct string is stored once
+    # and grouping, sorting and dedup work on integer codes. Rows reused from an expired
+    # disk cache keep its full category set, so categories without rows are dropped.
+    for column in ('manufacturername', 'name', 'letterdate'):
+        data[column] = data[column].astype('category').cat.remove_unused_categories()
+    
+    # Manufacturers sorted by name, skipping blank names; categories are already sorted and exclude missing values
+    year_data.manufacturers_by_name = [m for m in data['manufacturername'].cat.categories if m.strip()]
+    
+    # Parse dates once for both manufacturer and version ordering
+    data['letterdate_dt'] = pd.to_datetime(data['letterdate'], errors='coerce')
+    
+    # Manufacturers sorted by most recent date: sort every row by date, then keep each manufacturer's first row
+    latest = data[['manufacturername', 'letterdate_dt']].dropna(subset=['manufacturername'])
+    latest = latest.sort_values(['letterdate_dt', 'manufacturername'], ascending=[False, True], na_position='last')
+    latest = latest.drop_duplicates(subset='manufacturername', keep='first')
+    year_data.manufacturers_by_date = [
+        {'name': name, 'latest_date': date.strftime('%Y-%m-%d') if pd.notna(date) else 'No date'}
+        for name, date in zip(latest['manufacturername'].tolist(), latest['letterdate_dt'].tolist())
+    ]
+    
+    # Get each version with its date
+    versions = data[['manufacturername', 'name', 'letterdate', 'letterdate_dt']].drop_duplicates(subset=['manufacturername', 'name'])
+    
+    # Sort by datetime (most recent first), then by manufacturer name, then by version name
+    versions = versions.sort_values(['letterdate_dt', 'manufacturername', 'name'], ascending=[False, True, True], na_position='last')
+    
+    # Format versions for display
+    version_records = versions[['manufacturername', 'name', 'letterdate']].astype(object).rename(columns={'manufacturername': 'manufacturer', 'letterdate': 'date'})
+    version_records['display'] = (
+        version_records['manufacturer'] + ' - ' + version_records['name'].fillna('') +
+        ' (' + version_records['date'].fillna('') + ')'
+    )
+    year_data.versions = version_records.to_dict('records')
+    
+    # Positions of each manufacturer's versions within the sorted list
+    year_data.versions_by_mfr = versions.groupby('manufacturername', sort=False, observed=True).indices
+    
+    # PDF URLs keyed by lowercase (manufacturer, version); built in reverse so the first matching row wins
+    lookup = data.iloc[::-1]
+    year_data.pdf_index = dict(zip(zip(lookup['manufacturername'].str.lower(), lookup['name'].str.lower()), lookup['url']))
+    
+    # Content hash, so identical data gives the same ETags across refetches and worker processes
+    row_hashes = pd.util.hash_pandas_object(data[NHTSA_COLUMNS], index=False)
+    year_data.etag = hashlib.blake2b(row_hashes.values.tobytes(), digest_size=16).hexdigest()
+    
+    year_data.nbytes = int(data.memory_usage(deep=True).sum()) + estimate_size([
+        year_data.manufacturers_by_name, year_data.manufacturers_by_date, year_data.versions,
+        year_data.versions_by_mfr, year_data.pdf_index
+    ])
+    
+    return year_data
+
+def estimate_size(obj):
+    """Approximate bytes held by nested lists, tuples and dicts; shared objects are counted each time they appear"""
+    size = 0
+    pending = [obj]
+    while pending:
+        item = pending.pop()
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            pending.extend(item)
+    return size
+
 def get_cached_data(year):
     """Get data from memory cache if available and not expired"""
-    if year in memory_cache:
-        cached_time, data = memory_cache[year]
-        if datetime.now() - cached_time < CACHE_DURATION:
-            logger.info(f"Using cached data for year {year}")
-            return data
-        else:
-            # Remove expired cache
-            del memory_cache[year]
-            logger.info(f"Cache expired for year {year}")
+    with memory_cache_lock:
+        if year in memory_cache:
+            cached_time, year_data, _ = memory_cache[year]
+            if datetime.now() - cached_time < CACHE_DURATION:
+                memory_cache.move_to_end(year)
+                logger.info(f"Using cached data for year {year}")
+                return year_data
+            else:
+                # Remove expired cache
+                remove_cached_data(year)
+                logger.info(f"Cache expired for year {year}")
     return None
 
-def cache_data(year, data):
-    """Store data in memory cache"""
-    memory_cache[year] = (datetime.now(), data)
+def remove_cached_data(year):
+    """Drop a year from memory cache; the caller must hold memory_cache_lock"""
+    global memory_cache_bytes
+    _, _, size = memory_cache.pop(year)
+    memory_cache_bytes -= size
+
+def cache_data(year, year_data, cached_time=None):
+    """Store precomputed year data in memory cache, evicting least recently used years past the size cap"""
+    global memory_cache_bytes
+    size = year_data.nbytes
+    
+    with memory_cache_lock:
+        if year in memory_cache:
+            remove_cached_data(year)
+        memory_cache[year] = (cached_time or datetime.now(), year_data, size)
+        memory_cache_bytes += size
+        
+        # Always keep the newest entry, even if it alone exceeds the cap
+        while memory_cache_bytes > MEMORY_CACHE_MAX_BYTES and len(memory_cache) > 1:
+            evicted_year = next(iter(memory_cache))
+            remove_cached_data(evicted_year)
+            logger.info(f"Evicted year {evicted_year} from memory cache")
+    
     logger.info(f"Cached data for year {year}")
 
-def fetch_nhtsa_data(year):
-    """Fetch NHTSA data for a specific year with in-memory caching"""
-    # Check cache first
-    cached_data = get_cached_data(year)
-    if cached_data is not None:
-        return cached_data
+def disk_cache_path(year):
+    """Path of the parquet cache file for a year"""
+    return os.path.join(CACHE_DIR, f"{year}.parquet")
+
+def get_disk_cached_data(year):
+    """Get data from the parquet cache if available and not expired, as (cached_time, data)"""
+    if not HAS_PYARROW:
+        return None
     
-    logger.info(f"Fetching data for year {year} from NHTSA API")
+    path = disk_cache_path(year)
+    try:
+        cached_time = datetime.fromtimestamp(os.path.getmtime(path))
+    except OSError:
+        return None
     
-    all_data = pd.DataFrame()
-    page = 1
-    max_pages = 10  # Limit to prevent infinite loops
+    if datetime.now() - cached_time >= CACHE_DURATION:
+        logger.info(f"Disk cache expired for year {year}")
+        return None
     
-    while page <= max_pages:
-        url = f"https://vpic.nhtsa.dot.gov/api/vehicles/GetParts?type=565&fromDate=1/1/{year}&toDate=12/31/{year}&format=csv&page={page}"
-        
-        try:
-            response = requests.get(url, timeout=30)
+    try:
+        data = pd.read_parquet(path, engine='pyarrow')
+    except Exception as e:
+        logger.error(f"Error reading disk cache for year {year}: {str(e)}")
+        return None
+    
+    logger.info(f"Using disk cached data for year {year}")
+    return cached_time, data
+
+def disk_cache_pages_path(year):
+    """Path of the JSON sidecar recording each cached page's row count and HTTP validators"""
+    return os.path.join(CACHE_DIR, f"{year}.json")
+
+def get_disk_cached_pages(year):
+    """Split an expired parquet cache back into pages, as {page: (df, validators)} for conditional requests"""
+    if not HAS_PYARROW:
+        return {}
+    
+    try:
+        with open(disk_cache_pages_path(year)) as f:
+            pages = json.load(f)['pages']
+        data = pd.read_parquet(disk_cache_path(year), engine='pyarrow')
+    except Exception:
+        return {}
+    
+    cached_pages = {}
+    start = 0
+    for page_info in pages:
+        end = start + page_info['rows']
+        validators = {key: page_info[key] for key in ('etag', 'last_modified') if page_info.get(key)}
+        if validators:
+            cached_pages[page_info['page']] = (data.iloc[start:end], validators)
+        start = end
+    
+    # A sidecar that doesn't describe this parquet file can't be trusted
+    if start != len(data):
+        return {}
+    return cached_pages
+
+def write_atomically(path, write):
+    """Call write(tmp_path), then move the temporary file over path"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def write_json(path, obj):
+    with open(path, 'w') as f:
+        json.dump(obj, f)
+
+def disk_cache_data(year, data, pages):
+    """Store data and its page validators in the disk cache, replacing any previous files atomically"""
+    if not HAS_PYARROW:
+        return
+    
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        write_atomically(
+            disk_cache_path(year),
+            lambda path: data[NHTSA_COLUMNS].to_parquet(path, engine='pyarrow', compression='zstd', index=False)
+        )
+        write_atomically(disk_cache_pages_path(year), lambda path: write_json(path, {'pages': pages}))
+        logger.info(f"Wrote disk cache for year {year}")
+    except Exception as e:
+        logger.error(f"Error writing disk cache for year {year}: {str(e)}")
+
+def fetch_nhtsa_page(year, page, cached_page=None):
+    """Fetch and parse a single page of NHTSA data, returning (df, validators) with df None on failure
+    
+    cached_page is a (df, validators) pair from an earlier fetch; the request is made
+    conditional on it, and its df is reused if NHTSA reports the page unchanged.
+    """
+    url = f"https://vpic.nhtsa.dot.gov/api/vehicles/GetParts?type=565&fromDate=1/1/{year}&toDate=12/31/{year}&format=csv&page={page}"
+    
+    headers = {}
+    if cached_page is not None:
+        validators = cached_page[1]
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+    
+    try:
+        # Parse straight off the socket rather than buffering the page body
+        with http_session.get(url, headers=headers, stream=True, timeout=30) as response:
+            if response.status_code == 304 and cached_page is not None:
+                logger.info(f"Page {page} for year {year} not modified, reusing cached rows")
+                return cached_page
+            
             if response.status_code != 200:
                 logger.error(f"API returned status code {response.status_code} for year {year}, page {page}")
-                break
-                
-            df = pd.read_csv(io.StringIO(response.text))
-            
-            if df.empty or len(df) < 10:  # If we get very few results, we're probably at the end
-                logger.info(f"Reached end of data for year {year} at page {page}")
-                break
-                
-            all_data = pd.concat([all_data, df], ignore_index=True)
-            page += 1
-            
-        except Exception as e:
-            logger.error(f"Error fetching data for year {year}, page {page}: {str(e)}")
-            break
+                return None, None
+
+            validators = {
+                key: response.headers[header]
+                for key, header in (('etag', 'ETag'), ('last_modified', 'Last-Modified'))
+                if header in response.headers
+            }
+            response.raw.decode_content = True
+            return read_nhtsa_csv(response.raw), validators
+        
+    except Exception as e:
+        logger.error(f"Error fetching data for year {year}, page {page}: {str(e)}")
+        return None, None
+
+def reached_end(year, page, df):
+    """Check whether a fetched page marks the end of the data for a year"""
+    if df is None:
+        return True
+    if df.empty or len(df) < 10:  # If we get very few results, we're probably at the end
+        logger.info(f"Reached end of data for year {year} at page {page}")
+        return True
+    return False
+
+def download_nhtsa_data(year, cached_pages=None):
+    """Download all pages of NHTSA data for a year, returning the data and per-page info for the disk cache
+    
+    cached_pages maps page numbers to (df, validators) from an expired disk cache, which
+    turns those page requests into conditional requests.
+    """
+    cached_pages = cached_pages or {}
+    logger.info(f"Fetching data for year {year} from NHTSA API")
+    
+    def fetch_page(page):
+        return fetch_nhtsa_page(year, page, cached_pages.get(page))
+    
+    frames = []
+    pages = []
+    
+    def add_page(page, df, validators):
+        frames.append(df)
+        pages.append({'page': page, 'rows': len(df), **validators})
     
+    first_page, first_validators = fetch_page(1)
+    
+    if not reached_end(year, 1, first_page):
+        add_page(1, first_page, first_validators)
+        
+        # The year has more data, so fetch the remaining pages concurrently
+        later_pages = range(2, MAX_PAGES + 1)
+        executor = ThreadPoolExecutor(max_workers=PAGE_FETCH_WORKERS)
+        try:
+            results = executor.map(fetch_page, later_pages)
+            for page, (df, validators) in zip(later_pages, results):
+                if reached_end(year, page, df):
+                    break
+                add_page(page, df, validators)
+        finally:
+            # Pages past the end are not needed, so don't wait on them
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    # Single concat over all pages
+    all_data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
     logger.info(f"Fetched {len(all_data)} records for year {year}")
+    return all_data, pages
+
+def load_nhtsa_data(year):
+    """Load a year from the disk cache or the NHTSA API and store it in memory cache"""
+    # Another fetch may have finished between our cache miss and taking the lead
+    cached_data = get_cached_data(year)
+    if cached_data is not None:
+        return cached_data
+    
+    # Then the disk cache, which outlives the process
+    disk_cached = get_disk_cached_data(year)
+    if disk_cached is not None:
+        cached_time, data = disk_cached
+        year_data = build_year_data(data)
+        cache_data(year, year_data, cached_time)
+        return year_data
+    
+    # Revalidate any expired disk cache rather than downloading every page again
+    all_data, pages = download_nhtsa_data(year, get_disk_cached_pages(year))
+    year_data = build_year_data(all_data)
     
     # Cache the data
-    if not all_data.empty:
-        cache_data(year, all_data)
+    if not year_data.empty:
+        disk_cache_data(year, all_data, pages)
+        cache_data(year, year_data)
+    
+    return year_data
+
+def fetch_nhtsa_data(year):
+    """Fetch NHTSA data for a specific year with in-memory and on-disk caching"""
+    # Check cache first
+    cached_data = get_cached_data(year)
+    if cached_data is not None:
+        return cached_data
     
-    return all_data
+    # Only one thread loads a given year; concurrent requests wait for its result
+    with inflight_lock:
+        fetch = inflight_fetches.get(year)
+        is_leader = fetch is None
+        if is_leader:
+            fetch = inflight_fetches[year] = InflightFetch()
+    
+    if not is_leader:
+        logger.info(f"Waiting for in-flight fetch of year {year}")
+        if not fetch.done.wait(INFLIGHT_WAIT_TIMEOUT):
+            logger.error(f"Timed out waiting for in-flight fetch of year {year}")
+            return YearData(pd.DataFrame())
+        # Use the leader's result directly; its cache entry may already have expired or been evicted.
+        # If the fetch failed, don't repeat it
+        return fetch.year_data if fetch.year_data is not None else YearData(pd.DataFrame())
+    
+    try:
+        fetch.year_data = load_nhtsa_data(year)
+        return fetch.year_data
+    finally:
+        with inflight_lock:
+            del inflight_fetches[year]
+        fetch.done.set()
+
+def make_etag(*parts):
+    """Build an ETag from the values a response depends on"""
+    return hashlib.blake2b('\0'.join(map(str, parts)).encode(), digest_size=16).hexdigest()
+
+def add_cache_headers(response, etag, cache_control):
+    """Mark a response as cacheable by the browser"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def get_cached_pdf(url):
+    """Get PDF content from the PDF cache if available"""
+    with pdf_cache_lock:
+        content = pdf_cache.get(url)
+        if content is not None:
+            pdf_cache.move_to_end(url)
+        return content
+
+def cache_pdf(url, content):
+    """Store PDF content in the PDF cache, evicting least recently used PDFs past the count and size caps"""
+    global pdf_cache_bytes
+    with pdf_cache_lock:
+        if url in pdf_cache:
+            pdf_cache_bytes -= len(pdf_cache.pop(url))
+        pdf_cache[url] = content
+        pdf_cache_bytes += len(content)
+        
+        while len(pdf_cache) > PDF_CACHE_MAX_ENTRIES or pdf_cache_bytes > PDF_CACHE_MAX_BYTES:
+            _, evicted = pdf_cache.popitem(last=False)
+            pdf_cache_bytes -= len(evicted)
+
+def relay_pdf(url, response):
+    """Yield an upstream PDF in chunks, caching it once fully received if it is small enough"""
+    chunks = []
+    size = 0
+    try:
+        for chunk in response.iter_content(chunk_size=PDF_CHUNK_SIZE):
+            if chunks is not None:
+                size += len(chunk)
+                if size <= PDF_CACHE_MAX_ENTRY_BYTES:
+                    chunks.append(chunk)
+                else:
+                    chunks = None  # Too large to cache
+            yield chunk
+    finally:
+        # Also runs when the client disconnects mid-stream, so the upstream connection is released
+        response.close()
+    
+    if chunks is not None:
+        cache_pdf(url, b''.join(chunks))
+
+def warm_cache():
+    """Load the most commonly selected years so the first requests for them hit the cache"""
+    current_year = datetime.now().year
+    for year in (current_year, current_year - 1):
+        try:
+            fetch_nhtsa_data(year)
+        except Exception as e:
+            logger.error(f"Error warming cache for year {year}: {str(e)}")
+
+def start_cache_warmup():
+    """Warm the cache in the background; requests arriving meanwhile wait on the same in-flight fetch"""
+    threading.Thread(target=warm_cache, name='cache-warmup', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -99,41 +587,30 @@ def get_manufacturers(year):
     logger.info(f"Getting manufacturers for year {year}, sorted by {sort_by}")
     
     # Fetch data in real-time
-    data = fetch_nhtsa_data(year)
+    year_data = fetch_nhtsa_data(year)
     
-    if data.empty:
+    if year_data.empty:
         return jsonify({
             'manufacturers': [],
             'error': f'No data found for year {year}'
         })
     
-    if 'manufacturername' not in data.columns:
-        return jsonify({
-            'manufacturers': [],
-            'error': 'Invalid data format received from API'
-        })
+    sorted_by = 'date' if sort_by == 'date' else 'name'
+    etag = make_etag(year_data.etag, sorted_by)
+    if request.if_none_match.contains(etag):
+        return add_cache_headers(Response(status=304), etag, JSON_CACHE_CONTROL)
     
-    if sort_by == 'date' and 'letterdate' in data.columns:
-        # Sort by most recent date
-        manufacturer_dates = data.groupby('manufacturername')['letterdate'].max().reset_index()
-        manufacturer_dates['letterdate'] = pd.to_datetime(manufacturer_dates['letterdate'], errors='coerce')
-        manufacturer_dates = manufacturer_dates.sort_values('letterdate', ascending=False, na_position='last')
-        
-        # Include date information
-        manufacturer_list = []
-        for _, row in manufacturer_dates.iterrows():
-            manufacturer_list.append({
-                'name': row['manufacturername'],
-                'latest_date': row['letterdate'].strftime('%Y-%m-%d') if pd.notna(row['letterdate']) else 'No date'
-            })
-        
+    if sorted_by == 'date':
+        manufacturer_list = year_data.manufacturers_by_date
         logger.info(f"Found {len(manufacturer_list)} manufacturers sorted by date for year {year}")
-        return jsonify({'manufacturers': manufacturer_list, 'sorted_by': 'date'})
+        response = jsonify({'manufacturers': manufacturer_list, 'sorted_by': 'date'})
     else:
         # Sort by name (default)
-        manufacturers = sorted([m for m in data['manufacturername'].unique() if m and str(m).strip()])
+        manufacturers = year_data.manufacturers_by_name
         logger.info(f"Found {len(manufacturers)} manufacturers sorted by name for year {year}")
-        return jsonify({'manufacturers': manufacturers, 'sorted_by': 'name'})
+        response = jsonify({'manufacturers': manufacturers, 'sorted_by': 'name'})
+    
+    return add_cache_headers(response, etag, JSON_CACHE_CONTROL)
 
 @app.route('/get_versions/<int:year>', methods=['POST'])
 def get_versions(year):
@@ -144,37 +621,19 @@ def get_versions(year):
     logger.info(f"Getting versions for year {year}, manufacturers: {manufacturers}")
     
     # Fetch data in real-time
-    data = fetch_nhtsa_data(year)
+    year_data = fetch_nhtsa_data(year)
     
-    if data.empty:
+    if year_data.empty:
         return jsonify({'error': f'No data available for year {year}'})
     
-    # Filter data for selected manufacturers
-    filtered_data = data[data['manufacturername'].isin(manufacturers)]
+    # Merge the selected manufacturers' positions back into the overall sort order
+    selected = [year_data.versions_by_mfr[m] for m in set(manufacturers) if m in year_data.versions_by_mfr]
     
-    if filtered_data.empty:
+    if not selected:
         return jsonify({'error': 'No versions found for selected manufacturers'})
     
-    logger.info(f"Found {len(filtered_data)} records for selected manufacturers")
-    
-    # Get versions with dates and convert letterdate to datetime for proper sorting
-    versions = filtered_data[['manufacturername', 'name', 'letterdate']].drop_duplicates(subset=['manufacturername', 'name']).copy()
-    
-    # Convert letterdate to datetime for proper sorting
-    versions['letterdate_dt'] = pd.to_datetime(versions['letterdate'], errors='coerce')
-    
-    # Sort by datetime (most recent first), then by manufacturer name, then by version name
-    versions = versions.sort_values(['letterdate_dt', 'manufacturername', 'name'], ascending=[False, True, True], na_position='last')
-    
-    # Format versions for display
-    version_list = []
-    for _, row in versions.iterrows():
-        version_list.append({
-            'manufacturer': row['manufacturername'],
-            'name': row['name'],
-            'date': row['letterdate'],
-            'display': f"{row['manufacturername']} - {row['name']} ({row['letterdate']})"
-        })
+    positions = np.sort(np.concatenate(selected))
+    version_list = [year_data.versions[position] for position in positions]
     
     logger.info(f"Returning {len(version_list)} versions to frontend")
     return jsonify({'versions': version_list})
@@ -194,69 +653,64 @@ def get_pdf(year):
         return jsonify({'error': 'Missing manufacturer or version'})
     
     # Fetch data in real-time
-    nhtsa_data = fetch_nhtsa_data(year)
+    year_data = fetch_nhtsa_data(year)
     
-    if nhtsa_data.empty:
+    if year_data.empty:
         return jsonify({'error': f'No data available for year {year}'})
     
-    # Get the PDF URL - try exact match first
-    version_data = nhtsa_data[
-        (nhtsa_data['manufacturername'] == manufacturer) & 
-        (nhtsa_data['name'] == version)
-    ]
-    
-    logger.info(f"Exact match found: {len(version_data)} records")
+    # Get the PDF URL (case-insensitive match)
+    pdf_url = year_data.pdf_index.get((manufacturer.lower(), version.lower()))
     
-    if version_data.empty:
-        # Try case-insensitive match
-        version_data = nhtsa_data[
-            (nhtsa_data['manufacturername'].str.lower() == manufacturer.lower()) & 
-            (nhtsa_data['name'].str.lower() == version.lower())
-        ]
-        logger.info(f"Case-insensitive match found: {len(version_data)} records")
-    
-    if version_data.empty:
+    if pdf_url is None:
         logger.error(f"No version found for manufacturer: {manufacturer}, version: {version}")
         return jsonify({'error': f'Version "{version}" not found for manufacturer "{manufacturer}"'})
     
-    # Check if URL column exists
-    if 'url' not in version_data.columns:
-        logger.error(f"URL column not found. Available columns: {version_data.columns.tolist()}")
-        return jsonify({'error': 'PDF URL not available in data'})
-    
-    pdf_url = version_data.iloc[0]['url']
     logger.info(f"PDF URL: {pdf_url}")
     
+    # Create descriptive filename
+    clean_manufacturer = clean_filename(manufacturer)
+    clean_version = clean_filename(version)
+    filename = f"{year}_{clean_manufacturer}_{clean_version}.pdf"
+    
+    # GET is for viewing, POST is for downloading
+    disposition = 'inline' if request.method == 'GET' else 'attachment'
+    headers = {'Content-Disposition': f'{disposition}; filename="{filename}"'}
+    
+    # Viewed PDFs can be cached by the browser; the ETag needs only the URL, not the PDF
+    etag = make_etag(year, pdf_url)
+    if request.method == 'GET' and request.if_none_match.contains(etag):
+        return add_cache_headers(Response(status=304), etag, PDF_CACHE_CONTROL)
+    
+    def pdf_response(body):
+        response = Response(body, mimetype='application/pdf', headers=headers)
+        if request.method == 'GET':
+            add_cache_headers(response, etag, PDF_CACHE_CONTROL)
+        return response
+    
+    content = get_cached_pdf(pdf_url)
+    if content is not None:
+        logger.info(f"Using cached PDF: {pdf_url}")
+        return pdf_response(content)
+    
     try:
-        response = requests.get(pdf_url, timeout=30)
+        response = http_session.get(pdf_url, stream=True, timeout=30)
         if response.status_code == 200:
-            # Create descriptive filename
-            clean_manufacturer = clean_filename(manufacturer)
-            clean_version = clean_filename(version)
-            filename = f"{year}_{clean_manufacturer}_{clean_version}.pdf"
+            # The upstream length is only valid if requests isn't decompressing the body
+            if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                headers['Content-Length'] = response.headers['Content-Length']
             
-            if request.method == 'GET':
-                # For viewing
-                return send_file(
-                    io.BytesIO(response.content),
-                    mimetype='application/pdf',
-                    as_attachment=False,
-                    download_name=filename
-                )
-            else:
-                # For downloading
-                return send_file(
-                    io.BytesIO(response.content),
-                    mimetype='application/pdf',
-                    as_attachment=True,
-                    download_name=filename
-                )
+            # Relay the PDF to the client as it arrives instead of buffering it
+            return pdf_response(relay_pdf(pdf_url, response))
         else:
             logger.error(f"PDF fetch failed with status code: {response.status_code}")
+            response.close()
             return jsonify({'error': f'Could not fetch PDF. Status code: {response.status_code}'})
     except Exception as e:
         logger.error(f"Error accessing PDF: {str(e)}")
         return jsonify({'error': f'Error accessing PDF: {str(e)}'})
 
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=8080, debug=True) 
\ No newline at end of file
+    # With the debug reloader, only warm the cache in the process that serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_cache_warmup()
+    app.run(host='127.0.0.1', port=8080, debug=True) 
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+
+# Get port from environment variable (Hugging Face uses 7860)
+bind = f"0.0.0.0:{os.environ.get('PORT', 7860)}"
+
+# Requests mostly wait on NHTSA, so threaded workers give concurrency cheaply.
+# Each worker process keeps its own memory cache; size workers * threads >= peak concurrent clients.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
+
+
+def post_worker_init(worker):
+    # Warm each worker's cache once the app is loaded, rather than in the master where the thread wouldn't survive fork
+    from flask_app import start_cache_warmup
+    start_cache_warmup()